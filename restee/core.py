@@ -1,18 +1,18 @@
 import ee
-import copy
-import json
+import threading
 import backoff
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import numpy as np
-from io import StringIO
 import geopandas as gpd
 from affine import Affine
 from rasterio import features
-from pyproj import Transformer
+from pyproj import CRS, Transformer
 from collections.abc import Iterable
-from scipy import interpolate, ndimage
+from scipy import ndimage
 
-from google.auth.transport.requests import AuthorizedSession
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2 import service_account
 
 
@@ -38,21 +38,27 @@ class Domain:
             crs (str): string name of coordinate reference system of domain.
                 resolution units must match the crs units. default = "EPSG:4326"
         """
-        # set crs
+        # set crs, parsing it once to know how coordinates are labeled
         self._crs = crs
+        self._is_geographic = CRS.from_string(crs).is_geographic
 
         # set resolution info
         self.resolution = resolution
 
         # set the bounding box
-        if np.any((np.array(bbox) % self.resolution)) != 0:
+        if np.any(np.asarray(bbox) % self.resolution != 0):
             self.bbox = Domain._round_out(bbox, self.resolution)
         else:
             self.bbox = bbox
 
         minx, miny, maxx, maxy = self.bbox
-        y_coords = np.arange(miny+self.resolution, maxy+self.resolution, self.resolution)[::-1]
-        x_coords = np.arange(minx, maxx, self.resolution)
+
+        # derive pixel counts from the bbox so shapes do not depend on float round-off
+        # coordinates are the upper left corner of each pixel
+        nx = int(round((maxx - minx) / self.resolution))
+        ny = int(round((maxy - miny) / self.resolution))
+        x_coords = np.linspace(minx, maxx, nx, endpoint=False)
+        y_coords = np.linspace(maxy, miny, ny, endpoint=False)
 
         self.x_size = x_coords.size
         self.y_size = y_coords.size
@@ -62,21 +68,28 @@ class Domain:
 
         self._construct_grid()
 
-        self._mask = np.ones(self.shape)
+        # mask is created lazily, None means all pixels are valid
+        self._mask = None
 
         return
 
     def _construct_grid(self):
-        """Helper function to create a grid of coordinates and geotransform"""
+        """Helper function to create the grid shape, pixel centers, and geotransform"""
 
-        self.xx, self.yy = np.meshgrid(self.x_coords, self.y_coords)
+        self.shape = (self.y_size, self.x_size)
 
-        self.shape = self.xx.shape
+        # CF conventions are coordinates for center pixels
+        # coordinates are upper left corners so shift to center
+        self._x_centers = self.x_coords + (self.resolution / 2)
+        self._y_centers = self.y_coords - (self.resolution / 2)
 
         self.transform = Affine.from_gdal(
             *(self.bbox[0], self.resolution, 0.0, self.bbox[-1], 0.0, -self.resolution)
         )
 
+        # pixel grid is built on first access and reused for every request
+        self._pixelgrid = None
+
         return
 
     @property
@@ -87,34 +100,118 @@ class Domain:
         returns:
             dict: dictionary representation of pixel grid (https://developers.google.com/earth-engine/reference/rest/v1beta/PixelGrid)
         """
-        at_keys = ("translateX", "scaleX", "shearX", "translateY", "shearY", "scaleY")
-        gt = self.transform.to_gdal()
-        affinetranform = {k: gt[i] for i, k in enumerate(at_keys)}
+        if self._pixelgrid is None:
+            at_keys = ("translateX", "scaleX", "shearX", "translateY", "shearY", "scaleY")
+            gt = self.transform.to_gdal()
+            affinetranform = {k: gt[i] for i, k in enumerate(at_keys)}
+
+            dims = dict(width=self.x_size, height=self.y_size)
+
+            self._pixelgrid = dict(
+                affineTransform=affinetranform, dimensions=dims, crsCode=self.crs
+            )
 
-        dims = dict(width=self.x_size, height=self.y_size)
+        return self._pixelgrid
 
-        pgrid = dict(affineTransform=affinetranform, dimensions=dims, crsCode=self.crs)
+    @property
+    def xx(self):
+        """Property for the 2D grid of x coordinates. Returned as a read-only broadcasted
+        view of x_coords so no full grid is allocated
+        """
+        return np.broadcast_to(self.x_coords[np.newaxis, :], self.shape)
 
-        return pgrid
+    @property
+    def yy(self):
+        """Property for the 2D grid of y coordinates. Returned as a read-only broadcasted
+        view of y_coords so no full grid is allocated
+        """
+        return np.broadcast_to(self.y_coords[:, np.newaxis], self.shape)
+
+    @property
+    def x_centers(self):
+        """Property for the x coordinates of pixel centers"""
+        return self._x_centers
+
+    @property
+    def y_centers(self):
+        """Property for the y coordinates of pixel centers"""
+        return self._y_centers
 
     @property
     def crs(self):
         return self._crs
 
+    @property
+    def is_geographic(self):
+        """Property for whether the domain crs is geographic (i.e. units of degrees)"""
+        return self._is_geographic
+
     @property
     def mask(self):
+        if self._mask is None:
+            self._mask = np.ones(self.shape, dtype=np.bool_)
         return self._mask
 
     @mask.setter
     def mask(self, value):
         if value.shape == self.shape:
-            self._mask = value
+            self._mask = np.asarray(value, dtype=np.bool_)
         else:
             raise AttributeError(
                 f"provided mask has a shape of {value.shape} which does not match the domain shape of {self.shape}"
             )
         return
 
+    def axis_labels(self):
+        """Function to get the name, long name, and units of the x and y axes based
+        on the domain crs. Used to label coordinates of requested data
+
+        returns:
+            tuple: ((x_name, x_long_name, x_units), (y_name, y_long_name, y_units))
+        """
+        if self.is_geographic:
+            return ("lon", "Longitude", "degrees_east"), ("lat", "Latitude", "degrees_north")
+
+        # assumes all non-geographic projections have m units...
+        return ("x", "Eastings", "meters"), ("y", "Northings", "meters")
+
+    def _subset(self, rows: slice, cols: slice):
+        """Helper function to create a domain for a pixel aligned window of this domain
+
+        args:
+            rows (slice): row window of the domain
+            cols (slice): column window of the domain
+
+        returns:
+            restee.Domain: domain object covering the window with the same resolution and crs
+        """
+        x_coords = self.x_coords[cols]
+        y_coords = self.y_coords[rows]
+
+        # coordinates are already aligned so skip the constructor rounding
+        new = Domain.__new__(Domain)
+        new._crs = self._crs
+        new._is_geographic = self._is_geographic
+        new.resolution = self.resolution
+        new.bbox = (
+            x_coords[0],
+            y_coords[-1] - self.resolution,
+            x_coords[-1] + self.resolution,
+            y_coords[0],
+        )
+
+        new.x_size = x_coords.size
+        new.y_size = y_coords.size
+
+        new.x_coords = x_coords
+        new.y_coords = y_coords
+
+        new._construct_grid()
+
+        new._mask = None if self._mask is None else self._mask[rows, cols]
+
+        return new
+
     def to_ee_bbox(self):
         """Converts the domain bounding box to and ee.Geometry
 
@@ -135,30 +232,31 @@ class Domain:
         returns:
             restee.Domain: domain object with new resolution/coordinates
         """
-        new = copy.deepcopy(self)
-        new.resolution = float(new.resolution / factor)
-        # interpolate the x coordinates
-        old_x = np.arange(self.x_size) * factor
-        new_x = np.arange(self.x_size * factor)
-        f_x = interpolate.interp1d(
-            old_x, self.x_coords, bounds_error=False, fill_value="extrapolate"
-        )
-        new.x_coords = f_x(new_x)
+        # the bbox is already aligned so skip the constructor rounding, which would
+        # otherwise round the extent out again at the new resolution
+        new = Domain.__new__(Domain)
+        new._crs = self._crs
+        new._is_geographic = self._is_geographic
+        new.resolution = float(self.resolution / factor)
+        new.bbox = self.bbox
 
-        old_x = np.arange(self.y_size) * factor
-        new_x = np.arange(self.y_size * factor)
-        f_y = interpolate.interp1d(
-            old_x, self.y_coords, bounds_error=False, fill_value="extrapolate"
-        )
-        new.y_coords = f_y(new_x)
+        # coordinates step from the upper left corner at the new resolution
+        new.x_size = int(round(self.x_size * factor))
+        new.y_size = int(round(self.y_size * factor))
 
-        new.x_size = new.x_coords.size
-        new.y_size = new.y_coords.size
+        new.x_coords = self.bbox[0] + np.arange(new.x_size) * new.resolution
+        new.y_coords = self.bbox[3] - np.arange(new.y_size) * new.resolution
 
         new._construct_grid()
 
-        interp_mask = ndimage.zoom(self.mask, factor, order=0, mode="nearest")
-        new.mask = interp_mask.astype(np.bool)
+        new._mask = None
+
+        # an unset mask stays lazy on the new domain
+        if self._mask is not None:
+            interp_mask = ndimage.zoom(
+                self._mask.astype(np.uint8), factor, order=0, mode="nearest"
+            )
+            new.mask = interp_mask.astype(np.bool_)
 
         return new
 
@@ -174,13 +272,41 @@ class Domain:
 
         returns:
             restee.Domain: domain object with mask from vector
+
+        raises:
+            ValueError: when gdf has no geometries to define the domain
         """
+        # an empty frame has NaN bounds, fail with a clear message instead of deep in the constructor
+        if len(gdf) == 0:
+            raise ValueError("cannot create a domain from an empty GeoDataFrame")
+
         bbox = Domain._round_out(gdf.total_bounds, res=resolution)
         crs = gdf.crs.srs
         d = Domain(bbox, resolution, crs)
-        d.mask = features.geometry_mask(
-            gdf.geometry, d.shape, transform=d.transform, all_touched=True, invert=True
-        )
+
+        if len(gdf) == 1 and gdf.geometry.iloc[0].equals(gdf.geometry.iloc[0].envelope):
+            # fast path for a single rectangle, skips rasterizing the geometry
+            # find the row and column window of pixels the rectangle covers, the tolerance
+            # keeps edges on pixel boundaries of the rounded out bbox from adding a pixel
+            minx, miny, maxx, maxy = gdf.geometry.iloc[0].bounds
+            eps = 1e-6
+            x0, y0 = d.bbox[0], d.bbox[-1]
+            col0 = max(int(np.floor((minx - x0) / d.resolution + eps)), 0)
+            col1 = min(int(np.ceil((maxx - x0) / d.resolution - eps)), d.x_size)
+            row0 = max(int(np.floor((y0 - maxy) / d.resolution + eps)), 0)
+            row1 = min(int(np.ceil((y0 - miny) / d.resolution - eps)), d.y_size)
+
+            mask = np.zeros(d.shape, dtype=np.bool_)
+            mask[row0:row1, col0:col1] = True
+            d.mask = mask
+        else:
+            d.mask = features.geometry_mask(
+                gdf.geometry.values,
+                d.shape,
+                transform=d.transform,
+                all_touched=True,
+                invert=True,
+            )
         return d
 
     @staticmethod
@@ -223,14 +349,14 @@ class Domain:
         else:
             fc = geom
 
-        project = session.cloud_project
-        url = f"https://earthengine.googleapis.com/v1beta/projects/{project}/table:computeFeatures"
+        url = session.table_url
         serialized = ee.serializer.encode(fc, for_cloud_api=True)
         payload = dict(expression=serialized)
 
         response = session.send_request(url, payload)
 
-        gdf = gpd.read_file(StringIO(response.content.decode()))
+        table = orjson.loads(response.content)
+        gdf = gpd.GeoDataFrame.from_features(table, crs="EPSG:4326")
 
         return Domain.from_geopandas(gdf, resolution=resolution)
 
@@ -243,11 +369,10 @@ class Domain:
             bb (iterable): list of bounding box coordinates in the order of [W,S,E,N]
             res: (float): resolution of pixels to round bounding box to
         """
-        minx = bb[0] - (bb[0] % res)
-        miny = bb[1] - (bb[1] % res)
-        maxx = bb[2] + (res - (bb[2] % res))
-        maxy = bb[3] + (res - (bb[3] % res))
-        return minx, miny, maxx, maxy
+        bb = np.asarray(bb, dtype=np.float64)
+        lo = bb[:2] - (bb[:2] % res)
+        hi = bb[2:] + (res - (bb[2:] % res))
+        return (*lo, *hi)
 
 
 # @staticmethod
@@ -255,7 +380,53 @@ def _fatal_code(e):
     """Helper function defining a fatal error for backoff decorator to stop requests
     """
     # return 400 <= e.response.status_code < 500
-    return e.response.status_code == 404
+    # connection errors and timeouts have no response and are retried
+    return e.response is not None and e.response.status_code == 404
+
+
+def _retry_code(response):
+    """Helper function defining a transient error status for send_request to retry requests
+    """
+    return response.status_code in (429, 500, 502, 503, 504)
+
+
+def _raise_transient(response):
+    """Helper function to turn a transient error status into an exception so the backoff
+    decorator retries it with connection errors in one loop. The error body is read
+    before the response is closed so the server message is kept for the last try
+    """
+    try:
+        message = orjson.loads(response.content)["error"]["message"]
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        message = response.text
+    finally:
+        response.close()
+
+    raise requests.exceptions.HTTPError(
+        f"received the following bad status code: {response.status_code}\nServer message: {message}",
+        response=response,
+    )
+
+
+def _release_on_close(response, slots):
+    """Helper function to hold a request slot until a streamed response is closed
+    as the body is still being read from the socket after the request returns
+    """
+    close = response.close
+    lock = threading.Lock()
+    released = []
+
+    def _close():
+        try:
+            close()
+        finally:
+            with lock:
+                if not released:
+                    released.append(True)
+                    slots.release()
+
+    response.close = _close
+    return response
 
 
 class EESession:
@@ -263,15 +434,32 @@ class EESession:
     Users provides credentials that are used to create an authorized session to make HTTP requests
 
     """
-    def __init__(self, project: str, key: str):
+    def __init__(self, project: str, key: str, pool_size: int = 16):
         """Initialization function for the EESession class
 
         args:
             project (str): Google Cloud project name with service account whitelisted to use Earth Engine
             key (str): path to private key file for your whitelisted service account
+            pool_size (int): number of connections to keep open for concurrent requests, should be
+                at least the max_workers used when requesting image collections. default = 16
         """
         self._PROJECT = project
-        self._SESSION = self._get_session(key)
+        self._SESSION = self._get_session(key, pool_size)
+
+        # endpoint urls are fixed for the project so build them once
+        base_url = f"https://earthengine.googleapis.com/v1beta/projects/{project}"
+        self._IMAGE_URL = f"{base_url}/image:computePixels"
+        self._TABLE_URL = f"{base_url}/table:computeFeatures"
+        self._VALUE_URL = f"{base_url}/value:compute"
+
+        # bound in-flight requests to the connection pool size across all threads,
+        # nested thread pools (collections of tiled images) then wait for a free
+        # connection instead of opening and discarding extra ones
+        self._REQUEST_SLOTS = threading.BoundedSemaphore(pool_size * 2)
+
+        # get a token up front so the first concurrent requests do not all refresh
+        self._REFRESH_LOCK = threading.Lock()
+        self._refresh_credentials()
 
     @property
     def cloud_project(self):
@@ -281,34 +469,104 @@ class EESession:
     def session(self):
         return self._SESSION
 
+    @property
+    def image_url(self):
+        return self._IMAGE_URL
+
+    @property
+    def table_url(self):
+        return self._TABLE_URL
+
+    @property
+    def value_url(self):
+        return self._VALUE_URL
+
     @backoff.on_exception(
         backoff.expo,
         requests.exceptions.RequestException,
         max_tries=5,
         max_time=300,
         giveup=_fatal_code,
+        jitter=backoff.full_jitter,
     )
-    def send_request(self, url, data):
+    def send_request(self, url, data, stream: bool = False):
         """Method to send authenticated requests to google cloud.
         This is wrapped with a backoff decorator that will try multiple requests
-        if the initial ones fail.
+        if the initial ones fail with a connection error or a transient error status
+        (429 or 5xx), both share one limit of tries. This method is thread-safe, all threads share
+        the same authorized session and expired tokens are refreshed only once.
 
         args:
             url (str): EE REST API endpoint to send request.
                 See https://developers.google.com/earth-engine/reference/rest for more info
             data (dict): Dictionary object to send in the body of the Request.
+            stream (bool): flag to stream the response body rather than download it immediately.
+                streamed responses are requested without compression and hold their request
+                slot until the response is closed, so callers must close them. default = False
 
         returns:
             response: Reponse object with information on status and content
+
+        raises:
+            HTTPError: when the status is still a transient error after the last try
         """
-        return self.session.post(url=url, data=json.dumps(data))
+        if not self.session.credentials.valid:
+            self._refresh_credentials()
+
+        # orjson encodes the expression payload much faster than the stdlib json encoder
+        body = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+        headers = {"Content-Type": "application/json"}
+        if stream:
+            headers["Accept-Encoding"] = "identity"
+
+        if not stream:
+            with self._REQUEST_SLOTS:
+                response = self.session.post(
+                    url=url, data=body, headers=headers, timeout=(5, 120)
+                )
+        else:
+            self._REQUEST_SLOTS.acquire()
+            try:
+                response = self.session.post(
+                    url=url, data=body, headers=headers, stream=True, timeout=(5, 120)
+                )
+            except BaseException:
+                self._REQUEST_SLOTS.release()
+                raise
+
+            response = _release_on_close(response, self._REQUEST_SLOTS)
+
+        if _retry_code(response):
+            _raise_transient(response)
+
+        return response
+
+    def _refresh_credentials(self):
+        """Helper function to refresh the session token. Uses a lock so only one
+        thread refreshes when the token expires while the others wait for it
+        """
+        with self._REFRESH_LOCK:
+            credentials = self.session.credentials
+            if not credentials.valid:
+                credentials.refresh(Request())
+        return
 
     @staticmethod
-    def _get_session(key):
+    def _get_session(key, pool_size=16):
         """Helper function to authenticate"""
         credentials = service_account.Credentials.from_service_account_file(key)
         scoped_credentials = credentials.with_scopes(
             ["https://www.googleapis.com/auth/cloud-platform"]
         )
 
-        return AuthorizedSession(scoped_credentials)
+        session = AuthorizedSession(scoped_credentials)
+
+        # size the connection pool so concurrent requests do not block on each other
+        # retries are left to the backoff decorator on send_request so failed
+        # requests are not retried at two stacked layers
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size * 2)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+
+        return session
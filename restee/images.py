@@ -1,13 +1,16 @@
 import ee
 import time
-import json
+import shutil
+import weakref
+import threading
+import orjson
 import requests
 import numpy as np
 import pandas as pd
 import xarray as xr
 from tqdm import tqdm
 from io import BytesIO
-from pyproj import CRS
+from rasterio.io import MemoryFile
 from pathlib import Path
 from collections.abc import Iterable
 from concurrent.futures import ThreadPoolExecutor
@@ -15,6 +18,20 @@ from concurrent.futures import ThreadPoolExecutor
 from restee.core import Domain, EESession
 from restee.values import get_value
 
+# cache of serialized ee.Image expressions keyed by object id, entries are
+# removed when the image object is garbage collected
+_SERIALIZED = {}
+_SERIALIZED_LOCK = threading.RLock()
+
+# data formats that can be requested from computePixels
+_DATAFORMATS = ("NPY", "GEO_TIFF")
+
+# placeholder list index used to serialize a collection image expression once
+_INDEX_SENTINEL = -987654321
+
+# maximum number of pixels to request in a single computePixels call
+_MAX_TILE_PIXELS = 2_000_000
+
 
 def img_to_xarray(
     session: EESession,
@@ -38,7 +55,9 @@ def img_to_xarray(
             then no data will be masked by value. default = None
 
     returns:
-        xarray.Dataset: dataset with geocoordinates and each band as a variable
+        xarray.Dataset: dataset with geocoordinates and each band as a variable. when masking,
+            masked pixels are NaN and integer bands are promoted to float32 (float64 for
+            integers wider than 16 bits), otherwise band dtypes are preserved
 
     example:
         >>> img = (
@@ -51,51 +70,33 @@ def img_to_xarray(
         >>> ds_ndvi = ree.img_to_xarray(session,domain,img,no_data_value=0)
     """
 
-    if bands is None:
-        bands = get_value(session, image.bandNames())
+    pixels = _img_to_ndarray(session, domain, image, bands=bands)
 
-    pixels = img_to_ndarray(session, domain, image, bands=bands)
-
-    bandnames = pixels.dtype.names
-
-    if CRS.from_string(domain.crs).is_geographic:
-        x_name, y_name = "lon", "lat"
-        x_long, y_long = "Longitude", "Latitude"
-        x_units, y_units = "degrees_east", "degrees_north"
-
-    else:
-        x_name, y_name = (
-            "x",
-            "y",
-        )
-        x_long, y_long = "Eastings", "Northings"
-        # assumes all non-geographic projections have m units...
-        x_units, y_units = "meters", "meters"
+    (x_name, x_long, x_units), (y_name, y_long, y_units) = domain.axis_labels()
 
     # CF conventions are coordinates for center pixels
-    # assign domain coordinates and shift to center
     coords = {
         x_name: (
             [x_name],
-            domain.x_coords + (domain.resolution / 2),
+            domain.x_centers,
             {"units": x_units, "long_name": x_long},
         ),
         y_name: (
             [y_name],
-            domain.y_coords - (domain.resolution / 2),
+            domain.y_centers,
             {"units": y_units, "long_name": y_long},
         ),
     }
 
-    data_dict = {band: ([y_name, x_name], pixels[band]) for band in bandnames}
-
-    ds = xr.Dataset(data_dict, coords=coords)
+    data_vars = {}
 
-    if no_data_value is not None:
-        ds = ds.where(ds != no_data_value)
+    for band in pixels.dtype.names:
+        data = _apply_masks(pixels[band], domain, apply_mask, no_data_value)
+        # unmasked bands are read-only field views strided by the record size, copy them
+        # to contiguous writable memory, masked bands are already new arrays
+        data_vars[band] = ([y_name, x_name], np.require(data, requirements=["C", "W"]))
 
-    if apply_mask:
-        ds = ds.where(domain.mask == 1)
+    ds = xr.Dataset(data_vars, coords=coords)
 
     return ds
 
@@ -105,10 +106,11 @@ def imgcollection_to_xarray(
     domain: Domain,
     imagecollection: ee.ImageCollection,
     bands: Iterable = None,
-    max_workers: int = 5,
+    max_workers: int = 16,
     verbose: bool = False,
     apply_mask: bool = True,
     no_data_value: float = None,
+    chunks: dict = None,
 ):
     """Function to request ee.ImageCollection as a xarray Dataset. This function assumes 
     the image collection is distinguished by time (i.e. 'system:time_start' property).
@@ -122,14 +124,30 @@ def imgcollection_to_xarray(
             images must have `system:time_start` property
         bands (Iterable[str]): list or tuple or band names to request from image, if None then
             all bands will be requested. default = None
-        max_workers (int): number of concurrent requests to send. default = 5,
-        verbose (bool): flag to determine if a request progress bar should be shown. default = False
+        max_workers (int): number of concurrent requests to send. ignored when chunks is set.
+            default = 16
+        verbose (bool): flag to determine if a request progress bar should be shown. ignored when
+            chunks is set. default = False
         apply_mask (bool): mask pixels based on domain mask. default = True
         no_data_value (float): no data value to mask in returned dataset, typically 0. if None, 
             then no data will be masked by value. default = None
+        chunks (dict): chunk sizes along time for lazy requests, e.g. {"time": 1}. if set, bands are
+            backed by dask arrays, the first image is requested immediately for the band names and
+            dtypes and the others only when the data is computed, requires dask. band dtypes are
+            taken from the first image rather than promoted. concurrency then comes from the dask
+            scheduler used to compute the data and max_workers and verbose have no effect. if None,
+            then all images are requested immediately. default = None
 
     returns:
-        xarray.Dataset: dataset with multiple images along time dimesions, each band is a variable
+        xarray.Dataset: dataset with multiple images along time dimesions, each band is a variable.
+            when masking, masked pixels are NaN and integer bands are promoted to float32
+            (float64 for integers wider than 16 bits), otherwise band dtypes are preserved
+
+    raises:
+        ValueError: when images in the collection do not have the same bands, use bands
+            to request a common set
+        TypeError: when chunks is set and a band of a later image cannot be safely cast to
+            the dtype of the first image
 
     example:
         >>> ic = (
@@ -144,99 +162,163 @@ def imgcollection_to_xarray(
 
     #TODO: write functionality to allow the definition of ImageCollections by other properties than time
 
-    dates = get_value(session, imagecollection.aggregate_array("system:time_start"))
-    dates = pd.to_datetime(list(map(lambda x: x / 1e-6, dates)))
+    # request all of the collection metadata in one call
+    meta = ee.Dictionary(
+        {
+            "dates": imagecollection.aggregate_array("system:time_start"),
+            "id": imagecollection.get("system:id"),
+            "n": imagecollection.size(),
+        }
+    )
+    info = get_value(session, meta)
 
-    coll_id = get_value(session, imagecollection.get("system:id"))
+    # system:time_start is milliseconds since epoch
+    dates = pd.to_datetime(np.asarray(info["dates"], dtype="int64"), unit="ms")
 
-    n_imgs = get_value(session, imagecollection.size())
+    coll_id = info["id"]
 
-    if bands is None:
-        bands = get_value(session, ee.Image(imagecollection.first()).bandNames())
+    n_imgs = info["n"]
 
-    imgseq = range(n_imgs)
     imglist = imagecollection.toList(n_imgs)
 
-    def request_func(x):
-        return img_to_ndarray(session, domain, ee.Image(imglist.get(x)), bands=bands)
-
-    if n_imgs < max_workers:
-        gen = map(request_func, imgseq)
-
-        if verbose:
-            series = tuple(tqdm(gen, total=n_imgs, desc=f"{coll_id} progress"))
-        else:
-            series = tuple(gen)
+    # serialize the collection expression once, each image only differs by its list index
+    template = ee.serializer.encode(
+        ee.Image(imglist.get(_INDEX_SENTINEL)), for_cloud_api=True
+    )
+    if _count_constant(template, _INDEX_SENTINEL) != 1:
+        template = None
 
-    else:
-        with ThreadPoolExecutor(max_workers) as executor:
-            gen = executor.map(request_func, imgseq)
+    def fetch_func(x):
+        image = ee.Image(imglist.get(x))
+        serialized = None
+        if template is not None:
+            serialized = _replace_constant(template, _INDEX_SENTINEL, x)
 
-            if verbose:
-                series = tuple(tqdm(gen, total=n_imgs, desc=f"{coll_id} progress"))
-            else:
-                series = tuple(gen)
+        return _img_to_ndarray(
+            session, domain, image, bands=bands, serialized=serialized
+        )
 
-    if CRS.from_string(domain.crs).is_geographic:
-        x_name, y_name = "lon", "lat"
-        x_long, y_long = "Longitude", "Latitude"
-        x_units, y_units = "degrees_east", "degrees_north"
+    if chunks is not None:
+        canvas = _lazy_bands(fetch_func, domain, n_imgs, chunks)
 
     else:
-        x_name, y_name = (
-            "x",
-            "y",
-        )
-        x_long, y_long = "Eastings", "Northings"
-        # assumes all non-geographic projections have m units...
-        x_units, y_units = "meters", "meters"
+        canvas = _request_bands(fetch_func, domain, n_imgs, max_workers, verbose, coll_id)
+
+    (x_name, x_long, x_units), (y_name, y_long, y_units) = domain.axis_labels()
 
     # CF conventions are coordinates for center pixels
-    # assign domain coordinates and shift to center
-    data_dict = {
-        "time": {"dims": ("time"), "data": dates},
-        x_name: {
-            "dims": (x_name),
-            "data": domain.x_coords + (domain.resolution / 2),
-            "attrs": {"long_name": x_long, "units": x_units},
-        },
-        y_name: {
-            "dims": (y_name),
-            "data": domain.y_coords - (domain.resolution / 2),
-            "attrs": {"long_name": y_long, "units": y_units},
-        },
+    coords = {
+        "time": (["time"], dates),
+        x_name: (
+            [x_name],
+            domain.x_centers,
+            {"units": x_units, "long_name": x_long},
+        ),
+        y_name: (
+            [y_name],
+            domain.y_centers,
+            {"units": y_units, "long_name": y_long},
+        ),
     }
 
-    bandnames = series[0].dtype.names
-    series_shp = (n_imgs, domain.y_size, domain.x_size)
-
-    for i in range(n_imgs):
-        for band in bandnames:
-            if i == 0:
-                data_dict[band] = {
-                    "dims": ("time", y_name, x_name),
-                    "data": np.zeros(series_shp),
-                }
-            data_dict[band]["data"][i, :, :] = series[i][band][:, :]
+    data_vars = {}
 
-    ds = xr.Dataset.from_dict(data_dict)
+    for band, data in canvas.items():
+        if chunks is not None:
+            # mask each chunk lazily as it is computed
+            dtype = data.dtype
+            if apply_mask or no_data_value is not None:
+                dtype = np.result_type(dtype, np.float32)
+            data = data.map_blocks(
+                _apply_masks, domain, apply_mask, no_data_value, dtype=dtype
+            )
+        else:
+            data = _apply_masks(data, domain, apply_mask, no_data_value)
 
-    if no_data_value is not None:
-        ds = ds.where(ds != no_data_value)
+        data_vars[band] = (["time", y_name, x_name], data)
 
-    if apply_mask:
-        ds = ds.where(domain.mask == 1)
+    # arrays are passed by reference, the dataset does not copy them
+    ds = xr.Dataset(data_vars, coords=coords)
 
     return ds
 
 
+def imgcollection_to_zarr(
+    session: EESession,
+    domain: Domain,
+    imagecollection: ee.ImageCollection,
+    store,
+    bands: Iterable = None,
+    max_workers: int = 16,
+    verbose: bool = False,
+    apply_mask: bool = True,
+    no_data_value: float = None,
+):
+    """Function to request ee.ImageCollection directly into a Zarr store. Each image is
+    written to its own chunk as soon as it is received so the full collection never has
+    to fit in memory. This function wraps imgcollection_to_xarray with lazy chunks and
+    requires dask and zarr.
+
+    args:
+        session (EESession): Earth Engine cloud session used to manage REST API requests
+        domain (Domain): Domain object defining the spatial region to request image
+        imagecollection (ee.ImageCollection): computed ee.ImageCollection object to request,
+            images must have `system:time_start` property
+        store (str | MutableMapping): path or zarr store to write the collection to, existing
+            data in the store is overwritten
+        bands (Iterable[str]): list or tuple or band names to request from image, if None then
+            all bands will be requested. default = None
+        max_workers (int): number of concurrent requests to send. default = 16
+        verbose (bool): flag to determine if a progress bar should be shown. default = False
+        apply_mask (bool): mask pixels based on domain mask. default = True
+        no_data_value (float): no data value to mask in written dataset, typically 0. if None,
+            then no data will be masked by value. default = None
+
+    example:
+        >>> ic = (
+                ee.ImageCollection('MODIS/006/MOD13Q1')
+                .limit(100,"system:time_start")
+            )
+        >>> states = ee.FeatureCollection('TIGER/2018/States')
+        >>> maine = states.filter(ee.Filter.eq('NAME', 'Maine'))
+        >>> domain = restee.Domain.from_ee_geometry(session,maine,0.01)
+        >>> ree.imgcollection_to_zarr(session,domain,ic,"maine_ndvi.zarr",no_data_value=0)
+        >>> ds_ndvi = xr.open_zarr("maine_ndvi.zarr")
+    """
+    ds = imgcollection_to_xarray(
+        session,
+        domain,
+        imagecollection,
+        bands=bands,
+        apply_mask=apply_mask,
+        no_data_value=no_data_value,
+        chunks={"time": 1},
+    )
+
+    # images are fetched as their chunks are written, max_workers at a time
+    writer = ds.to_zarr(store, mode="w", compute=False)
+
+    if verbose:
+        from dask.diagnostics import ProgressBar
+
+        with ProgressBar():
+            writer.compute(num_workers=max_workers)
+    else:
+        writer.compute(num_workers=max_workers)
+
+    return
+
+
 def img_to_ndarray(
     session: EESession,
     domain: Domain,
     image: ee.Image,
     bands: Iterable = None,
+    dataformat: str = "NPY",
+    max_workers: int = 5,
 ):
-    """Function to request ee.Image as a numpy.ndarray
+    """Function to request ee.Image as a numpy.ndarray. Domains larger than
+    the tile pixel budget are requested as concurrent tiles and stitched together
 
     args:
         session (EESession): Earth Engine cloud session used to manage REST API requests
@@ -244,6 +326,11 @@ def img_to_ndarray(
         image (ee.Image): computed ee.Image object to request
         bands (Iterable[str]): list or tuple or band names to request from image, if None then
             all bands will be requested. default = None
+        dataformat (str): data format used to transfer the image, options are 'NPY' or 'GEO_TIFF'.
+            'GEO_TIFF' is decoded in memory with rasterio and all bands share a common dtype.
+            default = 'NPY'
+        max_workers (int): number of concurrent requests to send when the domain is requested
+            as tiles. default = 5
 
     returns:
         numpy.ndarray: structured numpy array where each band from image is a named field
@@ -259,12 +346,13 @@ def img_to_ndarray(
         >>> domain = restee.Domain.from_ee_geometry(session,maine,0.01)
         >>> ndvi_arr = ree.img_to_ndarray(session,domain,img)
     """
-    if bands is None:
-        bands = get_value(session, image.bandNames())
+    pixels = _img_to_ndarray(session, domain, image, bands, dataformat, max_workers)
 
-    pixels = _get_image(session, domain, image, bands, dataformat="NPY")
+    # NPY responses are parsed without copying and are read-only
+    if not pixels.flags.writeable:
+        pixels = pixels.copy()
 
-    return np.load(BytesIO(pixels))
+    return pixels
 
 
 def img_to_geotiff(
@@ -298,12 +386,7 @@ def img_to_geotiff(
 
     outfile = Path(outfile)
 
-    if bands is None:
-        bands = get_value(session, image.bandNames())
-
-    pixels = _get_image(session, domain, image, bands, dataformat="GEO_TIFF")
-
-    outfile.write_bytes(pixels)
+    _get_image(session, domain, image, bands, dataformat="GEO_TIFF", stream_to=outfile)
 
     return
 
@@ -314,6 +397,8 @@ def _get_image(
     image: ee.Image,
     bands: Iterable = None,
     dataformat: str = "NPY",
+    serialized: dict = None,
+    stream_to: Path = None,
 ):
     """Base function to request ee.Image object for a specified domain
 
@@ -325,43 +410,485 @@ def _get_image(
             all bands will be requested. default = None
         dataformat (str): data format to return compute image data for domain. current options are
             'NPY' or 'GEO_TIFF'. default = 'NPY'
+        serialized (dict): pre-serialized expression of image, if None then image is serialized.
+            default = None
+        stream_to (Path): file path to stream the response to instead of reading it into memory.
+            if None, then the response bytes are returned. default = None
 
     returns:
-        bytes: raw bytes in the format specified by dataformat
+        bytes: raw bytes in the format specified by dataformat, None when streamed to a file
 
     raises:
         RequestException: when request status code is not 200
         NotImplementedError: when defined dataformat is not "NPY" or "GEO_TIFF"
     """
-    project = session.cloud_project
-    if bands is None:
-        bands = get_value(session, project, image.bandNames())
+    # validate before sending so unsupported formats do not cost a request
+    if dataformat not in _DATAFORMATS:
+        raise NotImplementedError(
+            f"select dataformat {dataformat} is not implemented. Options are {', '.join(_DATAFORMATS)}"
+        )
 
-    url = f"https://earthengine.googleapis.com/v1beta/projects/{project}/image:computePixels"
+    url = session.image_url
 
-    serialized = ee.serializer.encode(image, for_cloud_api=True)
+    if serialized is None:
+        serialized = _serialize(image)
 
     payload = dict(
         expression=serialized,
         fileFormat=dataformat,
-        bandIds=bands,
         grid=domain.pixelgrid,
     )
 
-    response = session.send_request(url, payload)
+    # EE returns all bands when bandIds is omitted
+    if bands is not None:
+        payload["bandIds"] = list(bands)
+
+    if stream_to is None:
+        response = session.send_request(url, payload)
+
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(
+                f"received the following bad status code: {response.status_code}\nServer message: {orjson.loads(response.content)['error']['message']}"
+            )
+
+        return response.content
+
+    # streamed responses hold a connection and request slot until closed
+    response = session.send_request(url, payload, stream=True)
+    try:
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(
+                f"received the following bad status code: {response.status_code}\nServer message: {orjson.loads(response.content)['error']['message']}"
+            )
+
+        # copy from the socket to disk in blocks without buffering the whole body
+        response.raw.decode_content = True
+        try:
+            with open(stream_to, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=1 << 20)
+        except BaseException:
+            # do not leave a truncated file behind
+            if Path(stream_to).exists():
+                Path(stream_to).unlink()
+            raise
+    finally:
+        response.close()
+
+    return
+
 
-    if response.status_code != 200:
-        raise requests.exceptions.RequestException(
-            f"received the following bad status code: {response.status_code}\nServer message: {response.json()['error']['message']}"
+def _img_to_ndarray(
+    session: EESession,
+    domain: Domain,
+    image: ee.Image,
+    bands: Iterable = None,
+    dataformat: str = "NPY",
+    max_workers: int = 5,
+    serialized: dict = None,
+):
+    """Base function to request ee.Image as a numpy.ndarray without copying the
+    parsed response. Used by functions that copy the data into their own arrays
+
+    args:
+        session (EESession): Earth Engine cloud session used to manage REST API requests
+        domain (Domain): Domain object defining the spatial region to request image
+        image (ee.Image): computed ee.Image object to request
+        bands (Iterable[str]): list or tuple or band names to request from image, if None then
+            all bands will be requested. default = None
+        dataformat (str): data format used to transfer the image, options are 'NPY' or 'GEO_TIFF'.
+            default = 'NPY'
+        max_workers (int): number of concurrent requests to send when the domain is requested
+            as tiles. default = 5
+        serialized (dict): pre-serialized expression of image, if None then image is serialized.
+            default = None
+
+    returns:
+        numpy.ndarray: structured numpy array where each band from image is a named field,
+            may be a read-only view of the response bytes
+    """
+    # NPY responses carry band names in the dtype but GeoTIFF does not, so
+    # request the names alongside the pixels instead of before them
+    names = None
+    if bands is None and dataformat == "GEO_TIFF":
+        names_executor = ThreadPoolExecutor(1)
+        names = names_executor.submit(get_value, session, image.bandNames())
+        names_executor.shutdown(wait=False)
+
+    def request_func(d):
+        pixels = _get_image(
+            session, d, image, bands, dataformat=dataformat, serialized=serialized
         )
 
-    if dataformat in ["NPY", "GEO_TIFF"]:
-        result = response.content
-    elif dataformat == "TF_RECORD_IMAGE":
-        raise NotImplementedError()
-    else:
-        raise NotImplementedError(
-            f"select dataformat {dataformat} is not implemented.Options are 'NPY','GEO_TIFF', or 'TF_RECORD_IMAGE'"
+        if dataformat == "GEO_TIFF":
+            return _geotiff_to_ndarray(pixels, bands if names is None else names.result())
+
+        return _npy_to_ndarray(pixels)
+
+    if domain.x_size * domain.y_size <= _MAX_TILE_PIXELS:
+        return request_func(domain)
+
+    # split large domains into tiles that are requested concurrently
+    # each tile is written into its window of a single output array
+    tiles = tuple(_tile_domain(domain))
+
+    result = None
+    with ThreadPoolExecutor(min(max_workers, len(tiles))) as executor:
+        gen = executor.map(lambda tile: request_func(tile[2]), tiles)
+
+        for (rows, cols, _), pixels in zip(tiles, gen):
+            if result is None:
+                result = np.empty(domain.shape, dtype=pixels.dtype)
+            result[rows, cols] = pixels
+
+    return result
+
+
+def _count_constant(node, value):
+    """Helper function to count constant values in a serialized ee expression
+
+    args:
+        node (Any): serialized expression or part of one
+        value (Any): constant value to count
+
+    returns:
+        int: number of constantValue nodes equal to value
+    """
+    if isinstance(node, dict):
+        if "constantValue" in node and type(node["constantValue"]) is type(value):
+            return int(node["constantValue"] == value)
+        return sum(_count_constant(v, value) for v in node.values())
+    elif isinstance(node, list):
+        return sum(_count_constant(v, value) for v in node)
+    return 0
+
+
+def _replace_constant(node, old, new):
+    """Helper function to copy a serialized ee expression with a constant value replaced.
+    Much cheaper than serializing the ee object again
+
+    args:
+        node (Any): serialized expression or part of one
+        old (Any): constant value to replace
+        new (Any): value to replace it with
+
+    returns:
+        Any: copy of node with the constant replaced
+    """
+    if isinstance(node, dict):
+        if "constantValue" in node and type(node["constantValue"]) is type(old):
+            if node["constantValue"] == old:
+                return {"constantValue": new}
+        return {k: _replace_constant(v, old, new) for k, v in node.items()}
+    elif isinstance(node, list):
+        return [_replace_constant(v, old, new) for v in node]
+    return node
+
+
+def _tile_domain(domain: Domain, max_px: int = None):
+    """Helper generator to split a domain into pixel aligned square tiles
+
+    args:
+        domain (Domain): Domain object to split into tiles
+        max_px (int): maximum number of pixels per tile. if None, then the module
+            tile pixel budget is used. default = None
+
+    yields:
+        tuple[slice, slice, Domain]: row and column window of the tile within the domain
+            and the Domain object for the tile
+    """
+    if max_px is None:
+        max_px = _MAX_TILE_PIXELS
+
+    side = max(1, int(np.sqrt(max_px)))
+
+    for row in range(0, domain.y_size, side):
+        rows = slice(row, min(row + side, domain.y_size))
+        for col in range(0, domain.x_size, side):
+            cols = slice(col, min(col + side, domain.x_size))
+            yield rows, cols, domain._subset(rows, cols)
+
+
+def _request_bands(
+    fetch_func, domain: Domain, n_imgs: int, max_workers: int, verbose: bool, desc: str
+):
+    """Helper function to concurrently request every image of a collection into one
+    array per band. Arrays are allocated from the first response and promoted if a later
+    image has a wider band dtype. Each worker copies its image into its time slice so
+    responses are not retained
+
+    args:
+        fetch_func (Callable): function taking an image index and returning its structured array
+        domain (Domain): Domain object the images are requested for
+        n_imgs (int): number of images in the collection
+        max_workers (int): number of concurrent requests to send
+        verbose (bool): flag to determine if a request progress bar should be shown
+        desc (str): description for the progress bar
+
+    returns:
+        dict: band names mapped to arrays with shape (n_imgs, y, x)
+
+    raises:
+        ValueError: when images in the collection do not have the same bands
+    """
+    series_shp = (n_imgs, domain.y_size, domain.x_size)
+    canvas = {}
+    canvas_lock = threading.Lock()
+
+    def request_func(x):
+        pixels = fetch_func(x)
+
+        # copies are held under the lock so a band array is never replaced while
+        # another thread is writing into it, copies are cheap next to the request
+        with canvas_lock:
+            # every image must fill every band array, otherwise slices stay uninitialized
+            if canvas:
+                _check_bands(pixels.dtype.names, canvas)
+
+            for band in pixels.dtype.names:
+                dtype = pixels.dtype[band]
+                if band not in canvas:
+                    canvas[band] = np.empty(series_shp, dtype=dtype)
+                elif not np.can_cast(dtype, canvas[band].dtype, casting="safe"):
+                    # images with different band dtypes promote the whole band
+                    promoted = np.result_type(canvas[band].dtype, dtype)
+                    canvas[band] = canvas[band].astype(promoted)
+
+                np.copyto(canvas[band][x], pixels[band], casting="safe")
+
+        return
+
+    with ThreadPoolExecutor(min(max_workers, n_imgs)) as executor:
+        gen = executor.map(request_func, range(n_imgs))
+
+        if verbose:
+            gen = tqdm(gen, total=n_imgs, desc=f"{desc} progress")
+
+        # consume the results to wait for all requests and raise any errors
+        for _ in gen:
+            pass
+
+    return canvas
+
+
+def _check_bands(bandnames: Iterable, expected: Iterable):
+    """Helper function to check an image of a collection has the same bands as the others
+
+    args:
+        bandnames (Iterable[str]): band names of the image
+        expected (Iterable[str]): band names of the other images in the collection
+
+    raises:
+        ValueError: when the band names differ
+    """
+    if set(bandnames) != set(expected):
+        raise ValueError(
+            f"images in the collection have different bands {sorted(expected)} and {sorted(bandnames)}, "
+            "use the bands argument to select bands that all images have"
+        )
+
+    return
+
+
+def _lazy_bands(fetch_func, domain: Domain, n_imgs: int, chunks: dict):
+    """Helper function to build one lazy dask array per band for a collection where
+    each image after the first is requested only when its chunk is computed. Band names
+    and dtypes are taken from the first image, which is requested immediately
+
+    args:
+        fetch_func (Callable): function taking an image index and returning its structured array
+        domain (Domain): Domain object the images are requested for
+        n_imgs (int): number of images in the collection
+        chunks (dict): chunk sizes, the "time" key sets the number of images per chunk
+
+    returns:
+        dict: band names mapped to dask arrays with shape (n_imgs, y, x)
+
+    raises:
+        ImportError: when dask is not installed
+    """
+    try:
+        import dask
+        import dask.array as da
+    except ImportError:
+        raise ImportError("dask is required to request collections lazily with chunks")
+
+    # first image is requested up front for the band names and dtypes
+    first = fetch_func(0)
+    bandnames = first.dtype.names
+    delayed_fetch = dask.delayed(fetch_func, pure=True)
+    delayed_band = dask.delayed(_band_layer, pure=True)
+    images = [delayed_fetch(x) for x in range(1, n_imgs)]
+
+    canvas = {}
+    for band in bandnames:
+        dtype = first.dtype[band]
+        layers = [da.from_array(np.ascontiguousarray(first[band]))]
+        layers += [
+            da.from_delayed(
+                delayed_band(img, band, dtype, bandnames), shape=domain.shape, dtype=dtype
+            )
+            for img in images
+        ]
+        canvas[band] = da.stack(layers, axis=0).rechunk({0: chunks.get("time", 1)})
+
+    return canvas
+
+
+def _band_layer(pixels: np.ndarray, band: str, dtype: np.dtype, bandnames: Iterable):
+    """Helper function to copy one band of a lazily requested image into the dtype
+    declared for its dask array, applying the same band checks as eager requests
+
+    args:
+        pixels (numpy.ndarray): structured array of the image where each band is a named field
+        band (str): name of the band to copy
+        dtype (numpy.dtype): dtype declared for the band
+        bandnames (Iterable[str]): band names of the first image in the collection
+
+    returns:
+        numpy.ndarray: contiguous array of the band with shape (y, x)
+
+    raises:
+        ValueError: when the image does not have the same bands as the first image
+        TypeError: when the band cannot be safely cast to the declared dtype
+    """
+    _check_bands(pixels.dtype.names, bandnames)
+
+    if not np.can_cast(pixels.dtype[band], dtype, casting="safe"):
+        raise TypeError(
+            f"band {band} has dtype {pixels.dtype[band]} which cannot be safely cast to the dtype "
+            f"{dtype} of the first image, request the collection without chunks to promote dtypes"
         )
 
+    out = np.empty(pixels.shape, dtype=dtype)
+    np.copyto(out, pixels[band], casting="safe")
+
+    return out
+
+
+def _apply_masks(
+    data: np.ndarray, domain: Domain, apply_mask: bool, no_data_value: float = None
+):
+    """Helper function to mask no data values and pixels outside of the domain mask.
+    Both conditions are combined into one boolean mask so the data is only scanned
+    and copied once
+
+    args:
+        data (numpy.ndarray): array of pixel values where the last two axes are (y, x)
+        domain (Domain): Domain object with the mask to apply
+        apply_mask (bool): mask pixels based on domain mask
+        no_data_value (float): no data value to mask, if None then no data will not be
+            masked by value. default = None
+
+    returns:
+        numpy.ndarray: masked float array, or data unchanged when there is nothing to mask
+    """
+    valid = None
+    if no_data_value is not None:
+        valid = data != no_data_value
+    if apply_mask:
+        mask = domain.mask
+        valid = mask if valid is None else np.logical_and(valid, mask, out=valid)
+
+    if valid is None:
+        return data
+
+    return _mask_invalid(data, valid)
+
+
+def _mask_invalid(data: np.ndarray, valid: np.ndarray):
+    """Helper function to set invalid pixels to NaN. Integer data is promoted to the
+    smallest float type that represents it exactly rather than always float64
+
+    args:
+        data (numpy.ndarray): array of pixel values
+        valid (numpy.ndarray): boolean array broadcastable to data, True where pixels are valid
+
+    returns:
+        numpy.ndarray: float array with NaN where pixels are not valid
+    """
+    dtype = np.result_type(data.dtype, np.float32)
+    out = data.astype(dtype)
+    np.copyto(out, np.nan, where=~valid)
+
+    return out
+
+
+def _npy_to_ndarray(content: bytes):
+    """Helper function to parse raw NPY bytes into a numpy array. Reads the NPY header
+    and views the payload in place rather than going through np.load
+
+    args:
+        content (bytes): raw bytes in the NPY format
+
+    returns:
+        numpy.ndarray: read-only array sharing memory with content, use .copy() for a
+            writable array
+    """
+    buffer = BytesIO(content)
+    version = np.lib.format.read_magic(buffer)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buffer)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buffer)
+
+    if dtype.hasobject:
+        raise ValueError("NPY data with object fields cannot be read without pickle")
+
+    count = int(np.prod(shape))
+    order = "F" if fortran_order else "C"
+    arr = np.frombuffer(content, dtype=dtype, count=count, offset=buffer.tell())
+
+    return arr.reshape(shape, order=order)
+
+
+def _geotiff_to_ndarray(content: bytes, bands: Iterable):
+    """Helper function to decode raw GeoTIFF bytes into a structured numpy array
+    matching the layout of the NPY format
+
+    args:
+        content (bytes): raw bytes in the GeoTIFF format
+        bands (Iterable[str]): band names in the order they were requested
+
+    returns:
+        numpy.ndarray: structured numpy array where each band is a named field
+    """
+    with MemoryFile(content) as memfile:
+        with memfile.open() as src:
+            arr = src.read()
+
+    dtype = np.dtype([(band, arr.dtype) for band in bands])
+    result = np.empty(arr.shape[1:], dtype=dtype)
+    for i, band in enumerate(bands):
+        result[band] = arr[i]
+
     return result
+
+
+def _serialize(image: ee.Image):
+    """Helper function to serialize an ee.Image for the REST API. Results are cached
+    per image object so requesting the same image multiple times only walks the
+    expression graph once
+
+    args:
+        image (ee.Image): ee.Image object to serialize
+
+    returns:
+        dict: serialized expression of the image
+    """
+    key = id(image)
+    with _SERIALIZED_LOCK:
+        cached = _SERIALIZED.get(key)
+
+    if cached is not None and cached[0]() is image:
+        return cached[1]
+
+    serialized = ee.serializer.encode(image, for_cloud_api=True)
+
+    def _evict(_, key=key):
+        with _SERIALIZED_LOCK:
+            _SERIALIZED.pop(key, None)
+
+    with _SERIALIZED_LOCK:
+        _SERIALIZED[key] = (weakref.ref(image, _evict), serialized)
+
+    return serialized
@@ -1,7 +1,6 @@
 import ee
-import json
+import orjson
 import requests
-from io import StringIO
 from pathlib import Path
 import pandas as pd
 import geopandas as gpd
@@ -35,7 +34,7 @@ def features_to_file(
             )
         >>> restee.features_to_file(session,features,"state_ndvi.geojson")
     """
-    gdf = features_to_geopandas(session, features)
+    gdf = features_to_geodf(session, features)
 
     gdf.to_file(outfile,driver=driver)
 
@@ -70,9 +69,9 @@ def features_to_geodf(session: EESession, features: ee.FeatureCollection):
     if isinstance(features, ee.Feature):
         features = ee.FeatureCollection([features])
 
-    table = _get_table(session, features)
+    table = orjson.loads(_get_table(session, features))
 
-    return gpd.read_file(StringIO(table.decode()))
+    return gpd.GeoDataFrame.from_features(table, crs="EPSG:4326")
 
 
 def features_to_df(session: EESession, features: ee.FeatureCollection):
@@ -106,9 +105,9 @@ def features_to_df(session: EESession, features: ee.FeatureCollection):
     if isinstance(features, ee.Feature):
         features = ee.FeatureCollection([features])
 
-    table = _get_table(session, features)
+    table = orjson.loads(_get_table(session, features))
 
-    return pd.read_file(StringIO(table.decode()))
+    return pd.DataFrame([feature["properties"] for feature in table["features"]])
 
 
 
@@ -122,8 +121,7 @@ def _get_table(session: EESession, featurecollection: ee.FeatureCollection):
     returns:
         bytes: raw byte data of table in geojson format requested
     """
-    project = session.cloud_project
-    url = f"https://earthengine.googleapis.com/v1beta/projects/{project}/table:computeFeatures"
+    url = session.table_url
 
     serialized = ee.serializer.encode(featurecollection, for_cloud_api=True)
 
@@ -133,7 +131,7 @@ def _get_table(session: EESession, featurecollection: ee.FeatureCollection):
 
     if response.status_code != 200:
         raise requests.exceptions.RequestException(
-            f"received the following bad status code: {response.status_code}\nServer message: {response.json()['error']['message']}"
+            f"received the following bad status code: {response.status_code}\nServer message: {orjson.loads(response.content)['error']['message']}"
         )
 
     return response.content
@@ -1,6 +1,6 @@
 import ee
 import time
-import json
+import orjson
 import requests
 
 from restee.core import EESession
@@ -22,8 +22,7 @@ def get_value(session: EESession, value):
         >>> print(band_names)
             ['elevation', 'num', 'swb']
     """
-    project = session.cloud_project
-    url = f'https://earthengine.googleapis.com/v1beta/projects/{project}/value:compute'
+    url = session.value_url
 
     serialized = ee.serializer.encode(value, for_cloud_api=True)
 
@@ -33,6 +32,6 @@ def get_value(session: EESession, value):
 
     if response.status_code != 200:
         raise requests.exceptions.RequestException(
-            f"received the following bad status code: {response.status_code}\nServer message: {response.json()['error']['message']}")
+            f"received the following bad status code: {response.status_code}\nServer message: {orjson.loads(response.content)['error']['message']}")
 
-    return response.json()['result']
+    return orjson.loads(response.content)['result']
@@ -25,8 +25,13 @@ setup(name='restee',
         'geopandas',
         'pyproj',
         'requests',
+        'orjson',
         'backoff',
         'earthengine-api',
         'tqdm',
     ],
+      extras_require={
+        'dask': ['dask'],
+        'zarr': ['dask', 'zarr'],
+    },
 )
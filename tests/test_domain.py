@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+features = pytest.importorskip("rasterio.features")
+pytest.importorskip("ee")
+
+from shapely.geometry import box
+
+from restee.core import Domain
+
+
+@pytest.mark.parametrize(
+    "bounds,resolution",
+    [
+        ((3, -5, 4, -4), 0.1),
+        ((0.3, 0.3, 0.6, 0.6), 0.1),
+        ((0, 0, 1, 1), 0.01),
+        ((-120, 30, -100, 45), 0.25),
+        ((-10, -10, 10, 10), 0.5),
+        ((0.05, 0.05, 0.95, 0.55), 0.1),
+    ],
+)
+def test_rectangle_mask_matches_geometry_mask(bounds, resolution):
+    gdf = gpd.GeoDataFrame(geometry=[box(*bounds)], crs="EPSG:4326")
+    domain = Domain.from_geopandas(gdf, resolution=resolution)
+
+    expected = features.geometry_mask(
+        gdf.geometry.values,
+        domain.shape,
+        transform=domain.transform,
+        all_touched=True,
+        invert=True,
+    )
+
+    np.testing.assert_array_equal(domain.mask, expected)
+
+
+def test_empty_geodataframe_raises():
+    gdf = gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+
+    with pytest.raises(ValueError):
+        Domain.from_geopandas(gdf)